@@ -5,6 +5,8 @@ import os
 import sys
 import time
 from collections import defaultdict
+from queue import Queue
+from threading import Thread
 from datetime import datetime
 from itertools import chain
 from logging import critical, debug, error, info, warning
@@ -106,155 +108,204 @@ def main(env_id='MiniGrid-MazeS11N-v0',
 
     # RUN
 
-    datas = []
-    last_model_load = 0
-    model_step = 0
-    metrics_agg = defaultdict(list)
-    all_returns = []
-
-    while steps < num_steps:
-
-        if model is not None:
-            if time.time() - last_model_load > model_reload_interval:
-                while True:
-                    # takes ~10sec to load checkpoint
-                    model_step = mlflow_load_checkpoint(policy.model, map_location='cpu')  # type: ignore
-                    if model_step:
-                        info(f'Generator loaded model checkpoint {model_step}')
-                        last_model_load = time.time()
-                        break
-                    else:
-                        debug('Generator model checkpoint not found, waiting...')
-                        time.sleep(10)
-
-            if limit_step_ratio and steps >= model_step * limit_step_ratio:
-                # Rate limiting - keep looping until new model checkpoint is loaded
-                time.sleep(1)
-                continue
-
-        # Unroll one episode
-
-        epsteps = 0
-        timer = time.time()
-        obs = env.reset()
-        done = False
-        metrics = defaultdict(list)
-
-        while not done:
-            action, mets = policy(obs)
-            obs, reward, done, inf = env.step(action)
-            steps += 1
-            epsteps += 1
-            for k, v in mets.items():
-                metrics[k].append(v)
-
-        episodes += 1
-        data = inf['episode']  # type: ignore
-        if 'policy_value' in metrics:
-            data['policy_value'] = np.array(metrics['policy_value'] + [np.nan])     # last terminal value is null
-            data['policy_entropy'] = np.array(metrics['policy_entropy'] + [np.nan])  # last policy is null
-            data['action_prob'] = np.array([np.nan] + metrics['action_prob'])       # first action is null
-        else:
-            # Need to fill with placeholders, so all batches have the same keys
-            data['policy_value'] = np.full(data['reward'].shape, np.nan)
-            data['policy_entropy'] = np.full(data['reward'].shape, np.nan)
-            data['action_prob'] = np.full(data['reward'].shape, np.nan)
-
-        # Log
-
-        fps = epsteps / (time.time() - timer + 1e-6)
-        print_once('Episode data sample: ', {k: v.shape for k, v in data.items()})
-
-        info(f"Episode recorded:"
-             f"  steps: {epsteps}"
-             f",  reward: {data['reward'].sum()}"
-             f",  terminal: {data['terminal'].sum()}"
-             f",  visited: {(data.get('map_seen', np.zeros(1))[-1] > 0).mean():.1%}"
-             f",  total steps: {steps:.0f}"
-             f",  episodes: {episodes}"
-             f",  fps: {fps:.0f}"
-             )
-
-        if log_mlflow_metrics:
-            metrics = {f'{metrics_prefix}/{k}': np.mean(v) for k, v in metrics.items()}
-            all_returns.append(data['reward'].sum())
-            metrics.update({
-                f'{metrics_prefix}/episode_length': epsteps,
-                f'{metrics_prefix}/fps': fps,
-                f'{metrics_prefix}/steps': steps,
-                f'{metrics_prefix}/env_steps': steps * env_action_repeat,
-                f'{metrics_prefix}/episodes': episodes,
-                f'{metrics_prefix}/return': data['reward'].sum(),
-                f'{metrics_prefix}/return_cum': np.mean(all_returns[-100:]),
-            })  # type: ignore
-
-            # Calculate return_discounted
-            rewards_v = data['reward'].copy()
-            if not data['terminal'][-1]:
-                avg_value = rewards_v.mean() / (1.0 - metrics_gamma)
-                rewards_v[-1] += avg_value
-            returns_discounted = discount(rewards_v, gamma=metrics_gamma)
-            metrics[f'{metrics_prefix}/return_discounted'] = returns_discounted.mean()
-
-            # Calculate policy_value_terminal
-            if data['terminal'][-1]:
-                value_terminal = data['policy_value'][-2] - data['reward'][-1]  # This should be zero, because value[last] = reward[last]
-                metrics[f'{metrics_prefix}/policy_value_terminal'] = value_terminal
-
-            # Aggregate every 10 episodes
-
-            for k, v in metrics.items():
-                if not np.isnan(v):
-                    metrics_agg[k].append(v)
-
-            if len(metrics_agg[f'{metrics_prefix}/return']) >= log_every:
-                metrics_agg_max = {k: np.max(v) for k, v in metrics_agg.items()}
-                metrics_agg = {k: np.mean(v) for k, v in metrics_agg.items()}
-                metrics_agg[f'{metrics_prefix}/return_max'] = metrics_agg_max[f'{metrics_prefix}/return']
-                metrics_agg['_timestamp'] = datetime.now().timestamp()
-                mlflow.log_metrics(metrics_agg, step=model_step if model else 0)
-                metrics_agg = defaultdict(list)
-
-        # Save to npz
-
-        datas.append(data)
-        datas_episodes = len(datas)
-        datas_steps = sum(len(d['reset']) - 1 for d in datas)
-
-        if datas_steps >= steps_per_npz:
-
-            # Concatenate episodes
-
-            data = {}
-            for key in datas[0]:
-                data[key] = np.concatenate([b[key] for b in datas], axis=0)
-            datas = []
-            print_once('Collected data sample: ', {k: v.shape for k, v in data.items()})
-
-            # ... or chunk
-
-            # if steps_per_npz=1000, then chunk size will be [1000,1999]
-            if datas_steps >= 2 * steps_per_npz:
-                chunks = chunk_episode_data(data, steps_per_npz)
+    # Episode files are compressed and uploaded on a background thread, so rollouts don't wait.
+    # Bounded queue, so that unsaved data can't pile up if saving is slower than collection.
+    # If saving fails, the exception is re-raised here, so the generator process still dies on it.
+    writer_queue = Queue(maxsize=2)
+    writer_errors = []
+    writer = Thread(target=episode_writer, args=(writer_queue, writer_errors), daemon=True)
+    writer.start()
+
+    try:
+        discounted_mean(np.zeros(1), metrics_gamma)  # JIT warm-up, so the first episode log is not delayed
+
+        datas = []
+        datas_steps = 0
+        last_model_load = 0
+        model_step = 0
+        metrics_agg = defaultdict(list)
+        all_returns = []
+
+        while steps < num_steps:
+
+            if model is not None:
+                if time.time() - last_model_load > model_reload_interval:
+                    while True:
+                        # takes ~10sec to load checkpoint
+                        model_step = mlflow_load_checkpoint(policy.model, map_location='cpu')  # type: ignore
+                        if model_step:
+                            info(f'Generator loaded model checkpoint {model_step}')
+                            last_model_load = time.time()
+                            break
+                        else:
+                            debug('Generator model checkpoint not found, waiting...')
+                            time.sleep(10)
+
+                if limit_step_ratio and steps >= model_step * limit_step_ratio:
+                    # Rate limiting - keep looping until new model checkpoint is loaded
+                    time.sleep(1)
+                    continue
+
+            # Unroll one episode
+
+            epsteps = 0
+            timer = time.time()
+            obs = env.reset()
+            done = False
+            metrics_sum = defaultdict(float)
+            metrics_n = defaultdict(int)
+            policy_metrics = defaultdict(list)  # per-step values, which are saved with the episode
+
+            while not done:
+                action, mets = policy(obs)
+                obs, reward, done, inf = env.step(action)
+                steps += 1
+                epsteps += 1
+                for k, v in mets.items():
+                    metrics_sum[k] += v
+                    metrics_n[k] += 1
+                    if k in ('policy_value', 'policy_entropy', 'action_prob'):
+                        policy_metrics[k].append(v)
+
+            episodes += 1
+            data = inf['episode']  # type: ignore
+            if 'policy_value' in policy_metrics:
+                data['policy_value'] = np.array(policy_metrics['policy_value'] + [np.nan])     # last terminal value is null
+                data['policy_entropy'] = np.array(policy_metrics['policy_entropy'] + [np.nan])  # last policy is null
+                data['action_prob'] = np.array([np.nan] + policy_metrics['action_prob'])       # first action is null
             else:
-                chunks = [data]
+                # Need to fill with placeholders, so all batches have the same keys
+                data['policy_value'] = np.full(data['reward'].shape, np.nan)
+                data['policy_entropy'] = np.full(data['reward'].shape, np.nan)
+                data['action_prob'] = np.full(data['reward'].shape, np.nan)
+
+            # Log
+
+            fps = epsteps / (time.time() - timer + 1e-6)
+            print_once('Episode data sample: ', {k: v.shape for k, v in data.items()})
+
+            info(f"Episode recorded:"
+                 f"  steps: {epsteps}"
+                 f",  reward: {data['reward'].sum()}"
+                 f",  terminal: {data['terminal'].sum()}"
+                 f",  visited: {(data.get('map_seen', np.zeros(1))[-1] > 0).mean():.1%}"
+                 f",  total steps: {steps:.0f}"
+                 f",  episodes: {episodes}"
+                 f",  fps: {fps:.0f}"
+                 )
+
+            if log_mlflow_metrics:
+                metrics = {f'{metrics_prefix}/{k}': metrics_sum[k] / metrics_n[k] for k in metrics_sum}
+                all_returns.append(data['reward'].sum())
+                metrics.update({
+                    f'{metrics_prefix}/episode_length': epsteps,
+                    f'{metrics_prefix}/fps': fps,
+                    f'{metrics_prefix}/steps': steps,
+                    f'{metrics_prefix}/env_steps': steps * env_action_repeat,
+                    f'{metrics_prefix}/episodes': episodes,
+                    f'{metrics_prefix}/return': data['reward'].sum(),
+                    f'{metrics_prefix}/return_cum': np.mean(all_returns[-100:]),
+                })  # type: ignore
+
+                # Calculate return_discounted
+                rewards_v = data['reward'].copy()
+                if not data['terminal'][-1]:
+                    avg_value = rewards_v.mean() / (1.0 - metrics_gamma)
+                    rewards_v[-1] += avg_value
+                metrics[f'{metrics_prefix}/return_discounted'] = discounted_mean(rewards_v, metrics_gamma)
+
+                # Calculate policy_value_terminal
+                if data['terminal'][-1]:
+                    value_terminal = data['policy_value'][-2] - data['reward'][-1]  # This should be zero, because value[last] = reward[last]
+                    metrics[f'{metrics_prefix}/policy_value_terminal'] = value_terminal
+
+                # Aggregate every 10 episodes
+
+                for k, v in metrics.items():
+                    if not np.isnan(v):
+                        metrics_agg[k].append(v)
+
+                if len(metrics_agg[f'{metrics_prefix}/return']) >= log_every:
+                    metrics_agg_max = {k: np.max(v) for k, v in metrics_agg.items()}
+                    metrics_agg = {k: np.mean(v) for k, v in metrics_agg.items()}
+                    metrics_agg[f'{metrics_prefix}/return_max'] = metrics_agg_max[f'{metrics_prefix}/return']
+                    metrics_agg['_timestamp'] = datetime.now().timestamp()
+                    mlflow.log_metrics(metrics_agg, step=model_step if model else 0)
+                    metrics_agg = defaultdict(list)
 
             # Save to npz
 
-            repo = repository if (np.random.rand() > split_fraction) else repository2
-            for i, data in enumerate(chunks):
-                if 'image' in data and len(data['image'].shape) == 4:
-                    # THWC => HWCT for better compression
-                    data['image_t'] = data['image'].transpose(1, 2, 3, 0)
-                    del data['image']
-                else:
-                    # Categorical image, leave it alone
-                    pass
-                repo.save_data(data, episodes - datas_episodes, episodes - 1, i)
+            datas.append(data)
+            datas_episodes = len(datas)
+            datas_steps += len(data['reset']) - 1
+
+            if datas_steps >= steps_per_npz:
+
+                # Concatenate episodes
+
+                # Allocate the output once per key, and copy episodes into their slices
+                offsets = np.cumsum([0] + [len(b['reset']) for b in datas])
+                data = {}
+                for key, first in datas[0].items():
+                    out = np.empty((offsets[-1],) + first.shape[1:], dtype=first.dtype)
+                    for i, b in enumerate(datas):
+                        out[offsets[i]:offsets[i + 1]] = b[key]
+                    data[key] = out
+                datas = []
+                print_once('Collected data sample: ', {k: v.shape for k, v in data.items()})
 
+                # ... or chunk
+
+                # if steps_per_npz=1000, then chunk size will be [1000,1999]
+                if datas_steps >= 2 * steps_per_npz:
+                    chunks = chunk_episode_data(data, steps_per_npz)
+                else:
+                    chunks = [data]
+                datas_steps = 0
+
+                # Save to npz
+
+                repo = repository if (np.random.rand() > split_fraction) else repository2
+                for i, data in enumerate(chunks):
+                    if 'image' in data and len(data['image'].shape) == 4:
+                        # THWC => HWCT for better compression
+                        # Materialize contiguous, so the writer doesn't have to iterate a strided view
+                        img = data.pop('image')
+                        img_t = np.empty(img.shape[1:] + img.shape[:1], dtype=img.dtype)
+                        np.copyto(img_t, img.transpose(1, 2, 3, 0))
+                        data['image_t'] = img_t
+                    else:
+                        # Categorical image, leave it alone
+                        pass
+                    if writer_errors:
+                        raise writer_errors[0]
+                    writer_queue.put((repo, data, episodes - datas_episodes, episodes - 1, i))
+    finally:
+        # Also on errors and interrupts: finish saving the chunks which are already queued
+        writer_queue.put(None)
+        writer_queue.join()
+
+    if writer_errors:
+        raise writer_errors[0]
     info('Generator done.')
 
 
+def episode_writer(queue: Queue, errors: list):
+    while True:
+        item = queue.get()
+        try:
+            if item is None:
+                break
+            if errors:
+                continue  # already failed - keep draining, so that put() and join() in main don't block
+            repo, data, episode_from, episode_to, chunk_seq = item
+            repo.save_data(data, episode_from, episode_to, chunk_seq)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            queue.task_done()
+
+
 class RandomPolicy:
     def __init__(self, action_space):
         self.action_space = action_space
@@ -277,10 +328,11 @@ class NetworkPolicy:
             action_distr, new_state, metrics = self.model.forward(obs_model, self.state)
             action = action_distr.sample()
             self.state = new_state
+            metrics.update(action_prob=action_distr.log_prob(action).exp().mean(),
+                           policy_entropy=action_distr.entropy().mean())
+            metrics_values = torch.stack(list(metrics.values())).tolist()  # one conversion instead of .item() per metric
 
-        metrics = {k: v.item() for k, v in metrics.items()}
-        metrics.update(action_prob=action_distr.log_prob(action).exp().mean().item(),
-                       policy_entropy=action_distr.entropy().mean().item())
+        metrics = dict(zip(metrics.keys(), metrics_values))
 
         action = action.squeeze()  # (1,1,A) => A
         return action.numpy(), metrics
@@ -1,5 +1,7 @@
+import json
 import os
 import random
+import tempfile
 import time
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
@@ -51,13 +53,25 @@ class EpisodeRepository(ABC):
         ...
 
 
+def is_missing_artifact_error(e: Exception) -> bool:
+    # Each artifact store reports a missing file differently, and their client libraries are optional
+    if isinstance(e, FileNotFoundError):
+        return True
+    if isinstance(e, OSError) and 'No such file or directory' in str(e):
+        return True  # LocalArtifactRepository
+    return type(e).__name__ in ['NotFound', 'ResourceNotFoundError']  # GCS, Azure
+
+
 class MlflowEpisodeRepository(EpisodeRepository):
 
+    COUNTERS_FILE = 'counters.json'
+
     def __init__(self, artifact_uris: Union[str, List[str]]):
         super().__init__()
         self.artifact_uris = [artifact_uris] if isinstance(artifact_uris, str) else artifact_uris
         self.read_repos: List[ArtifactRepository] = [get_artifact_repository(uri) for uri in self.artifact_uris]
         self.write_repo = self.read_repos[0]
+        self.counters: Optional[Tuple[int, int, int]] = None  # (files, steps, episodes) in write_repo
 
     def save_data(self, data: Dict[str, np.ndarray], episode_from: int, episode_to: int, chunk_seq: Optional[int] = None):
         n_episodes = data['reset'].sum()
@@ -65,6 +79,8 @@ class MlflowEpisodeRepository(EpisodeRepository):
         reward = data['reward'].sum()
         fname = self.build_episode_name(episode_from, episode_to, reward, n_steps, chunk_seq=chunk_seq)
         print_once(f'Saving episode data ({chunk_seq}):', self.write_repo.artifact_uri + '/' + fname)
+        # Counters go first: if killed in between, a restart skips episode ids instead of reusing them
+        self.update_counters(n_steps, episode_to)
         mlflow_log_npz(data, fname, repository=self.write_repo)
 
     def list_files(self) -> List[FileInfo]:
@@ -81,10 +97,43 @@ class MlflowEpisodeRepository(EpisodeRepository):
         return files
 
     def count_steps(self):
-        files = self.list_files()
-        steps = sum(f.steps for f in files)
-        episodes = (max(f.episode_to for f in files) + 1) if files else 0
-        return len(files), steps, episodes
+        # Counters file is only kept for the single write_repo, otherwise list all files
+        counters = self.load_counters() if len(self.read_repos) == 1 else None
+        if counters is not None:
+            debug(f'Counted steps from {self.COUNTERS_FILE} in {self}: {counters}')
+        else:
+            files = self.list_files()
+            steps = sum(f.steps for f in files)
+            episodes = (max(f.episode_to for f in files) + 1) if files else 0
+            counters = (len(files), steps, episodes)
+            debug(f'Counted steps by listing files in {self}: {counters}')
+        self.counters = counters
+        return counters
+
+    def load_counters(self) -> Optional[Tuple[int, int, int]]:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            try:
+                path = self.write_repo.download_artifacts(self.COUNTERS_FILE, tmpdir)
+            except Exception as e:
+                if is_missing_artifact_error(e):
+                    return None  # Not written yet - fall back to listing files
+                raise
+            try:
+                counters = json.loads(Path(path).read_text())
+                return (int(counters['files']), int(counters['steps']), int(counters['episodes']))
+            except (ValueError, KeyError, TypeError) as e:
+                debug(f'Unreadable {self.COUNTERS_FILE} in {self} ({e!r}), listing files instead')
+                return None
+
+    def update_counters(self, steps: int, episode_to: int):
+        if self.counters is None:
+            self.counters = self.count_steps()
+        nfiles, nsteps, nepisodes = self.counters
+        self.counters = (nfiles + 1, nsteps + int(steps), max(nepisodes, episode_to + 1))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / self.COUNTERS_FILE
+            path.write_text(json.dumps(dict(zip(['files', 'steps', 'episodes'], self.counters))))
+            self.write_repo.log_artifact(str(path))
 
     
     def build_episode_name(self, episode_from, episode, reward, steps, chunk_seq=None):
@@ -52,5 +52,5 @@ def create_env(env_id: str, no_terminal: bool, env_time_limit: int, env_action_r
     if env_time_limit > 0:
         env = TimeLimitWrapper(env, env_time_limit)
     env = ActionRewardResetWrapper(env, no_terminal)
-    env = CollectWrapper(env)
+    env = CollectWrapper(env, initial_capacity=env_time_limit or 1000)
     return env
@@ -7,6 +7,7 @@ import gym_minigrid.envs
 import gym_minigrid.minigrid
 from gym_minigrid.minigrid import COLOR_TO_IDX, OBJECT_TO_IDX
 import numpy as np
+from numba import njit
 
 
 class MiniGrid(gym.Env):
@@ -121,12 +122,7 @@ class MiniGrid(gym.Env):
 
     @staticmethod
     def to_categorical(image_ids):
-        n = len(MiniGrid.GRID_VALUES)
-        out = np.zeros(image_ids.shape[:-1] + (n,))
-        for i in range(n):
-            val = MiniGrid.GRID_VALUES[i]
-            out[..., i] = (image_ids == val).all(axis=-1)
-        out = out.argmax(axis=-1).astype(np.uint8)  # (..., 7, 7, 33) => (..., 7, 7)
+        out = GRID_IDS[image_ids[..., 0], image_ids[..., 1], image_ids[..., 2]]  # (..., 7, 7, 3) => (..., 7, 7)
         return out
 
     @staticmethod
@@ -217,55 +213,72 @@ class MinigridWanderPolicy:
     def __call__(self, obs) -> Tuple[int, dict]:
         if obs['image'].shape == (7, 7):
             (ax, ay) = (3, 6)  # agent is here
-            front = MiniGrid.GRID_VALUES[obs['image'][ax, ay - 1]]  # front is up
-            left = MiniGrid.GRID_VALUES[obs['image'][ax - 1, ay]]
-            right = MiniGrid.GRID_VALUES[obs['image'][ax + 1, ay]]
+            grid = obs['image']  # front is up
         elif 'map_centered' in obs:
             ax = ay = obs['map_centered'].shape[0] // 2  # agent is here
-            front = MiniGrid.GRID_VALUES[obs['map_centered'][ax, ay - 1]]
-            left = MiniGrid.GRID_VALUES[obs['map_centered'][ax - 1, ay]]
-            right = MiniGrid.GRID_VALUES[obs['map_centered'][ax + 1, ay]]
+            grid = obs['map_centered']
         else:
             assert False, f'Unsupported observation {obs["image"].shape}'
 
-        empty = [1, 8]  # Empty or goal
+        action = wander_decide(int(grid[ax, ay - 1]), int(grid[ax - 1, ay]), int(grid[ax + 1, ay]), GRID_LUT)
+        return action, {}
 
-        # Door on left => turn with 50%
-        if left[0] == 4 and np.random.rand() < 0.50:
-            return 0, {}
 
-        # Door on right => turn with 50%
-        if right[0] == 4 and np.random.rand() < 0.50:
-            return 1, {}
+GRID_LUT = MiniGrid.GRID_VALUES.astype(np.int16)  # cell id => (object, color, state)
 
-        # Empty left  => turn with 10%
-        if left[0] in empty and np.random.rand() < 0.10:
-            return 0, {}
+# Inverse of GRID_LUT: (object, color, state) => cell id, unknown values map to 0 (invisible)
+GRID_IDS = np.zeros((max(OBJECT_TO_IDX.values()) + 1, max(COLOR_TO_IDX.values()) + 1, 4), dtype=np.uint8)
+for i in reversed(range(len(MiniGrid.GRID_VALUES))):  # reversed, so that first match wins, as with argmax
+    GRID_IDS[tuple(MiniGrid.GRID_VALUES[i])] = i
 
-        # Empty right => turn with 10%
-        if right[0] in empty and np.random.rand() < 0.10:
-            return 1, {}
 
-        # Closed door => open
-        if front[0] == 4 and front[2] == 1:
-            return 5, {}
+@njit
+def wander_decide(front_id, left_id, right_id, lut):
+    front_kind = lut[front_id, 0]
+    front_state = lut[front_id, 2]
+    left_kind = lut[left_id, 0]
+    right_kind = lut[right_id, 0]
 
-        # Empty or open door => forward
-        if front[0] in empty or (front[0] == 4 and front[2] == 0):
-            return 2, {}
+    left_empty = left_kind == 1 or left_kind == 8  # Empty or goal
+    right_empty = right_kind == 1 or right_kind == 8
+    front_empty = front_kind == 1 or front_kind == 8
 
-        # If forward blocked...
+    # Door on left => turn with 50%
+    if left_kind == 4 and np.random.rand() < 0.50:
+        return 0
 
-        # If wall left and not right => turn right
-        if left[0] == 2 and right[0] != 2:
-            return 1, {}
+    # Door on right => turn with 50%
+    if right_kind == 4 and np.random.rand() < 0.50:
+        return 1
 
-        # If wall right and not left => turn left
-        if right[0] == 2 and left[0] != 2:
-            return 0, {}
+    # Empty left  => turn with 10%
+    if left_empty and np.random.rand() < 0.10:
+        return 0
 
-        # Left-right 50%
-        if np.random.rand() < 0.50:
-            return 0, {}
-        else:
-            return 1, {}
+    # Empty right => turn with 10%
+    if right_empty and np.random.rand() < 0.10:
+        return 1
+
+    # Closed door => open
+    if front_kind == 4 and front_state == 1:
+        return 5
+
+    # Empty or open door => forward
+    if front_empty or (front_kind == 4 and front_state == 0):
+        return 2
+
+    # If forward blocked...
+
+    # If wall left and not right => turn right
+    if left_kind == 2 and right_kind != 2:
+        return 1
+
+    # If wall right and not left => turn left
+    if right_kind == 2 and left_kind != 2:
+        return 0
+
+    # Left-right 50%
+    if np.random.rand() < 0.50:
+        return 0
+    else:
+        return 1
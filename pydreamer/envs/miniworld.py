@@ -58,6 +58,8 @@ class MazeDijkstraPolicy:
     #   1) Pick a random spot on a map
     #   2) Go there using shortest path
     #   3) Occasionally perform a random action
+    # The path is planned once and followed until the agent leaves it (random action,
+    # unexpected position or new goal), so BFS doesn't run on every step.
 
     def __init__(self, step_size, turn_size, epsilon=0.10):
         self.step_size = step_size
@@ -65,6 +67,9 @@ class MazeDijkstraPolicy:
         self.epsilon = epsilon
         self.goal = None
         self.expected_pos = None
+        self.plan_actions = []
+        self.plan_path = []
+        self.plan_ix = 0
 
     def __call__(self, obs) -> Tuple[int, dict]:
         assert 'agent_pos' in obs, 'Need agent position'
@@ -86,27 +91,39 @@ class MazeDijkstraPolicy:
             if not np.isclose(self.expected_pos[:2], [x, y], 1e-3).all():
                 print('WARN: unexpected position - stuck? Generating new goal...')
                 self.goal = self.generate_goal(map)
-
-        while True:
-            t = time.time()
-            actions, path, nvis = find_shortest(map, (x, y, d), self.goal, self.step_size, self.turn_size)
-            # print(f'Pos: {tuple(np.round([x,y,d], 2))}'
-            #       f', Goal: {self.goal}'
-            #       f', Len: {len(actions)}'
-            #       f', Actions: {actions[:1]}'
-            #       # f', Path: {path[:1]}'
-            #       f', Visited: {nvis}'
-            #       f', Time: {int((time.time()-t)*1000)}'
-            #       )
-            if len(actions) > 0:
-                if np.random.rand() < self.epsilon:
-                    self.expected_pos = None
-                    return np.random.randint(3), {}  # random action
+                self.expected_pos = None  # replan
+            elif abs((self.expected_pos[2] - d + 180.0) % 360.0 - 180.0) > 0.1:
+                self.expected_pos = None  # turned differently than planned - replan from actual heading
+
+        if self.expected_pos is not None and self.plan_ix + 1 < len(self.plan_actions):
+            # Still on the planned path
+            self.plan_ix += 1
+        else:
+            while True:
+                t = time.time()
+                actions, path, nvis = find_shortest(map, (x, y, d), self.goal, self.step_size, self.turn_size)
+                # print(f'Pos: {tuple(np.round([x,y,d], 2))}'
+                #       f', Goal: {self.goal}'
+                #       f', Len: {len(actions)}'
+                #       f', Actions: {actions[:1]}'
+                #       # f', Path: {path[:1]}'
+                #       f', Visited: {nvis}'
+                #       f', Time: {int((time.time()-t)*1000)}'
+                #       )
+                if len(actions) > 0:
+                    break
                 else:
-                    self.expected_pos = path[0]
-                    return actions[0], {}  # best action
-            else:
-                self.goal = self.generate_goal(map)
+                    self.goal = self.generate_goal(map)
+            self.plan_actions = actions
+            self.plan_path = path
+            self.plan_ix = 0
+
+        if np.random.rand() < self.epsilon:
+            self.expected_pos = None
+            return np.random.randint(3), {}  # random action
+        else:
+            self.expected_pos = self.plan_path[self.plan_ix]
+            return self.plan_actions[self.plan_ix], {}  # best action
 
     @staticmethod
     def generate_goal(map):
@@ -117,72 +134,91 @@ class MazeDijkstraPolicy:
                 return x, y
 
 
-@njit
+@njit(nogil=True)
 def find_shortest(map, start, goal, step_size=1.0, turn_size=45.0):
     KPREC = 5
     RADIUS = 0.2
-    x, y, d = start
+    MAX_VISITED = 100000
+    x, y, d0 = start
     gx, gy = goal
+    W, H = map.shape[0], map.shape[1]
+    ND = int(round(360.0 / turn_size))
+    assert abs(ND * turn_size - 360.0) < 1e-6, 'Heading bins need turn_size to divide 360'
 
     # Well ok, this is BFS not Dijkstra, technically speaking
 
-    que = []
+    # State is (x, y, k), where k is the number of right turns (mod ND) relative to start direction d0.
+    # Visited states are binned on a 1/KPREC grid, queue is stored as flat arrays, indexed by state number.
+    visited = np.zeros((W * KPREC + 1, H * KPREC + 1, ND), dtype=np.uint8)
+    que_x = np.empty(MAX_VISITED, dtype=np.float64)
+    que_y = np.empty(MAX_VISITED, dtype=np.float64)
+    que_k = np.empty(MAX_VISITED, dtype=np.int32)
+    parent = np.empty(MAX_VISITED, dtype=np.int32)
+    parent_action = np.empty(MAX_VISITED, dtype=np.int8)
+
+    # Forward step for each heading bin
+    angles = (d0 + np.arange(ND) * turn_size) / 180 * np.pi
+    DX = step_size * np.cos(angles)
+    DY = step_size * np.sin(angles)
+
+    que_x[0] = x
+    que_y[0] = y
+    que_k[0] = 0
+    parent[0] = -1
+    parent_action[0] = -1
+    visited[int(round(x * KPREC)), int(round(y * KPREC)), 0] = 1
+    n = 1
     que_ix = 0
-    visited = {}
-    parent = {}
-    parent_action = {}
-
-    p = (x, y, d)
-    key = (round(x * KPREC) / KPREC, round(y * KPREC) / KPREC, round(d * KPREC) / KPREC)
-    que.append(p)
-    visited[key] = True
-    goal_state = None
-
-    while que_ix < len(que):
-        p = que[que_ix]
+    goal_ix = -1
+
+    while que_ix < n:
+        i = que_ix
         que_ix += 1
-        x, y, d = p
+        x, y, k = que_x[i], que_y[i], que_k[i]
         if int(x) == int(gx) and int(y) == int(gy):
-            goal_state = p
+            goal_ix = i
             break
         for action in range(3):
-            x1, y1, d1 = x, y, d
+            x1, y1, k1 = x, y, k
             if action == 0:  # turn left
-                d1 = d - turn_size
-                if d1 < -180.0:
-                    d1 += 360.0
+                k1 = k - 1 if k > 0 else ND - 1
             if action == 1:  # turn right
-                d1 = d + turn_size
-                if d1 > 180.0:
-                    d1 -= 360.0
+                k1 = k + 1 if k < ND - 1 else 0
             if action == 2:  # forward
-                x1 = x + step_size * np.cos(d / 180 * np.pi)
-                y1 = y + step_size * np.sin(d / 180 * np.pi)
+                x1 = x + DX[k]
+                y1 = y + DY[k]
                 # Check wall collision at 4 corners
-                for x2, y2 in [(x1 - RADIUS, y1 - RADIUS), (x1 + RADIUS, y1 - RADIUS), (x1 - RADIUS, y1 + RADIUS), (x1 + RADIUS, y1 + RADIUS)]:
-                    if x2 < 0 or y2 < 0 or x2 >= map.shape[0] or y2 >= map.shape[1] or map[int(x2), int(y2)] == WALL:
-                        x1, y1 = x, y  # wall
-                        break
-            p1 = (x1, y1, d1)
-            key = (round(x1 * KPREC) / KPREC, round(y1 * KPREC) / KPREC, round(d1 * KPREC) / KPREC)
-            if key not in visited:
-                que.append(p1)
-                parent[p1] = p
-                parent_action[p1] = action
-                visited[key] = True
-                assert len(visited) < 100000, 'Runaway Dijkstra'
+                # (bounds are compared as floats, because int() truncates e.g. -0.1 to 0)
+                blocked = (x1 - RADIUS < 0) | (y1 - RADIUS < 0) | (x1 + RADIUS >= W) | (y1 + RADIUS >= H)
+                if not blocked:
+                    ix0, ix1 = int(x1 - RADIUS), int(x1 + RADIUS)
+                    iy0, iy1 = int(y1 - RADIUS), int(y1 + RADIUS)
+                    blocked = (map[ix0, iy0] == WALL) | (map[ix1, iy0] == WALL) | (map[ix0, iy1] == WALL) | (map[ix1, iy1] == WALL)
+                if blocked:
+                    x1, y1 = x, y  # wall
+            ix1, iy1 = int(round(x1 * KPREC)), int(round(y1 * KPREC))
+            if visited[ix1, iy1, k1] == 0:
+                assert n < MAX_VISITED, 'Runaway Dijkstra'
+                visited[ix1, iy1, k1] = 1
+                que_x[n] = x1
+                que_y[n] = y1
+                que_k[n] = k1
+                parent[n] = i
+                parent_action[n] = action
+                n += 1
 
     path = []
     actions = []
-    if goal_state is not None:
-        p = goal_state
-        while p in parent_action:
-            path.append(p)
-            actions.append(parent_action[p])
-            p = parent[p]
+    if goal_ix >= 0:
+        i = goal_ix
+        while parent[i] >= 0:
+            d = (d0 + que_k[i] * turn_size + 180.0) % 360.0 - 180.0
+            path.append((que_x[i], que_y[i], d))
+            actions.append(int(parent_action[i]))
+            i = parent[i]
         path.reverse()
         actions.reverse()
     else:
         print('WARN: no path found')
 
-    return actions, path, len(visited)
+    return actions, path, n
@@ -42,12 +42,16 @@ class ActionRewardResetWrapper(gym.Wrapper):
         self.no_terminal = no_terminal
         # Handle environments with one-hot or discrete action, but collect always as one-hot
         self.action_size = env.action_space.n if hasattr(env.action_space, 'n') else env.action_space.shape[0]
+        # Read-only templates - CollectWrapper copies obs into its buffers, so rows can be returned as views
+        self.action_onehots = np.eye(self.action_size, dtype=np.float32)
+        self.action_zero = np.zeros(self.action_size, dtype=np.float32)
+        self.action_onehots.flags.writeable = False
+        self.action_zero.flags.writeable = False
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
         if isinstance(action, int):
-            action_vec = np.zeros(self.action_size)
-            action_vec[action] = 1.0
+            action_vec = self.action_onehots[action]
         else:
             assert isinstance(action, np.ndarray) and action.shape == (self.action_size,), "Wrong one-hot action shape"
             action_vec = action
@@ -59,7 +63,7 @@ class ActionRewardResetWrapper(gym.Wrapper):
 
     def reset(self):
         obs = self.env.reset()
-        obs['action'] = np.zeros(self.action_size)
+        obs['action'] = self.action_zero
         obs['reward'] = np.array(0.0)
         obs['terminal'] = np.array(False)
         obs['reset'] = np.array(True)
@@ -67,25 +71,43 @@ class ActionRewardResetWrapper(gym.Wrapper):
 
 
 class CollectWrapper(gym.Wrapper):
+    """Records episode observations into preallocated per-key buffers."""
 
-    def __init__(self, env):
+    def __init__(self, env, initial_capacity=1000):
         super().__init__(env)
         self.env = env
-        self.episode = []
+        self.initial_capacity = initial_capacity  # buffer length, grows if episode is longer
+        self.buffers = {}
+        self.t = 0
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
-        self.episode.append(obs.copy())
+        self.write(obs)
         if done:
-            episode = {k: np.array([t[k] for t in self.episode]) for k in self.episode[0]}
+            episode = {k: v[:self.t].copy() for k, v in self.buffers.items()}
             info['episode'] = episode
         return obs, reward, done, info
 
     def reset(self):
         obs = self.env.reset()
-        self.episode = [obs.copy()]
+        layout = {k: (np.shape(v), np.asarray(v).dtype) for k, v in obs.items()}
+        if layout != {k: (v.shape[1:], v.dtype) for k, v in self.buffers.items()}:
+            self.buffers = {k: np.empty((self.initial_capacity + 1,) + shape, dtype) for k, (shape, dtype) in layout.items()}
+        self.t = 0
+        self.write(obs)
         return obs
 
+    def write(self, obs):
+        capacity = len(next(iter(self.buffers.values())))
+        if self.t == capacity:
+            for k, v in self.buffers.items():
+                grown = np.empty((2 * capacity,) + v.shape[1:], v.dtype)
+                grown[:self.t] = v
+                self.buffers[k] = grown
+        for k, v in self.buffers.items():
+            v[self.t] = obs[k]
+        self.t += 1
+
 
 class OneHotActionWrapper(gym.Wrapper):
     """Allow to use one-hot action on a discrete action environment."""